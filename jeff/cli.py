@@ -0,0 +1,200 @@
+#
+#  Copyright (c) 2015 Jason Lynch <jason@calindora.com>
+#
+#  Permission is hereby granted, free of charge, to any person obtaining a copy
+#  of this software and associated documentation files (the "Software"), to deal
+#  in the Software without restriction, including without limitation the rights
+#  to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+#  copies of the Software, and to permit persons to whom the Software is
+#  furnished to do so, subject to the following conditions:
+#
+#  The above copyright notice and this permission notice shall be included in
+#  all copies or substantial portions of the Software.
+#
+#  THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+#  IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+#  FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+#  AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+#  LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+#  OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+#  SOFTWARE.
+#
+
+import argparse
+import contextlib
+import csv
+import datetime
+import json
+import os
+import sys
+import time
+import xdg.BaseDirectory
+
+from . import library
+from . import trace
+
+
+#
+# Commands
+#
+
+
+def command_config(lib, args):
+    if args.value is not None:
+        if args.value < 2:
+            print("The choice count must be at least 2", file=sys.stderr)
+            sys.exit(1)
+
+        lib.set_choice_count(args.value)
+
+    print("{} {}".format(args.key, lib.get_choice_count()))
+
+
+def command_dedupe(lib, args):
+    start = time.time()
+    hashed, merged = lib.deduplicate(args.workers)
+    print(
+        "Hashed {} files and merged {} duplicate tracks in {:.3f} seconds".format(hashed, merged, time.time() - start)
+    )
+
+
+def command_import(lib, args):
+    start = time.time()
+
+    # Reading from stdin must not close it for the rest of the process.
+    with open(args.path, newline="") if args.path != "-" else contextlib.nullcontext(sys.stdin) as f:
+        if args.format == "csv" or (args.format is None and args.path.endswith(".csv")):
+            reader = csv.DictReader(f)
+            rows = ((reader.line_num, row["winner"], row["loser"], row.get("timestamp")) for row in reader)
+        else:
+            rows = ((number, json.loads(line)) for number, line in enumerate(f, start=1) if line.strip())
+            rows = ((number, row["winner"], row["loser"], row.get("timestamp")) for number, row in rows)
+
+        now = datetime.datetime.now()
+        invalid = 0
+
+        def parse_rows():
+            # A row with a malformed timestamp is reported and skipped rather than aborting an import that has
+            # already committed earlier batches.
+            nonlocal invalid
+
+            for number, winner, loser, timestamp in rows:
+                try:
+                    timestamp = parse_timestamp(timestamp) if timestamp else now
+                except ValueError:
+                    print("Invalid timestamp on line {}: {}".format(number, timestamp), file=sys.stderr)
+                    invalid += 1
+                    continue
+
+                yield winner, loser, timestamp
+
+        imported, skipped = lib.import_comparisons(parse_rows())
+        skipped += invalid
+
+    print("Imported {} comparisons ({} skipped) in {:.3f} seconds".format(imported, skipped, time.time() - start))
+
+    if not args.no_replay:
+        command_replay(lib, args)
+
+
+def command_next(lib, args):
+    for track in lib.get_next_tracks(args.count or lib.get_choice_count()):
+        print("{}\t{:.3f}\t{}".format(track.id, track.rating, track.path))
+
+
+def command_rank(lib, args):
+    for rank, row in enumerate(lib.get_ranking(args.limit), start=1):
+        print(
+            "{:6} {:8.3f} {:8.3f} {:6} {}".format(
+                rank, row["rating"], row["deviation"], row["comparisons"], row["path"]
+            )
+        )
+
+
+def command_replay(lib, args):
+    start = time.time()
+    count = lib.replay_ratings()
+    print("Replayed {} comparisons in {:.3f} seconds".format(count, time.time() - start))
+
+
+def command_scan(lib, args):
+    start = time.time()
+    lib.scan_directories(args.loudness, args.workers)
+    print("Scanned directories in {:.3f} seconds".format(time.time() - start))
+
+
+def command_submit(lib, args):
+    tracks = []
+
+    for reference in [args.winner, *args.losers]:
+        track = lib.find_track(reference)
+
+        if not track:
+            print("Unknown track: {}".format(reference), file=sys.stderr)
+            sys.exit(1)
+
+        tracks.append(track)
+
+    lib.update_playing(tracks[0], tracks[1:])
+
+
+#
+# Functions
+#
+
+
+def parse_timestamp(value):
+    try:
+        return datetime.datetime.fromtimestamp(float(value))
+    except ValueError:
+        return datetime.datetime.fromisoformat(value)
+
+
+def run():
+    parser = argparse.ArgumentParser(prog="jeff-cli", description="Rank tracks without the graphical interface.")
+    parser.add_argument(
+        "--library",
+        default=os.path.join(xdg.BaseDirectory.save_config_path("jeff"), "library.sqlite"),
+        help="path of the library database",
+    )
+
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    subparser = subparsers.add_parser("config", help="show or change a library setting")
+    subparser.add_argument("key", choices=["choice-count"], help="setting to show or change")
+    subparser.add_argument("value", type=int, nargs="?", help="new value (shows the current one if omitted)")
+    subparser.set_defaults(function=command_config)
+
+    subparser = subparsers.add_parser("next", help="print the next tracks to compare")
+    subparser.add_argument("--count", type=int, help="number of tracks (defaults to the configured choice count)")
+    subparser.set_defaults(function=command_next)
+
+    subparser = subparsers.add_parser("submit", help="record a winning track against one or more losing tracks")
+    subparser.add_argument("winner", help="track id, MusicBrainz id or file path")
+    subparser.add_argument("losers", nargs="+", help="track ids, MusicBrainz ids or file paths")
+    subparser.set_defaults(function=command_submit)
+
+    subparser = subparsers.add_parser("rank", help="print tracks ordered by rating")
+    subparser.add_argument("--limit", type=int, help="number of tracks to print")
+    subparser.set_defaults(function=command_rank)
+
+    subparser = subparsers.add_parser("import", help="import comparisons from a JSONL or CSV stream")
+    subparser.add_argument("path", help="file with winner, loser and optional timestamp fields, or - for stdin")
+    subparser.add_argument("--format", choices=["csv", "jsonl"], help="input format (guessed from the extension)")
+    subparser.add_argument("--no-replay", action="store_true", help="do not recompute ratings afterwards")
+    subparser.set_defaults(function=command_import)
+
+    subparser = subparsers.add_parser("dedupe", help="merge tracks without MusicBrainz ids whose audio is identical")
+    subparser.add_argument("--workers", type=int, help="number of hashing processes")
+    subparser.set_defaults(function=command_dedupe)
+
+    subparser = subparsers.add_parser("scan", help="add new and remove missing files from the library directories")
+    subparser.add_argument("--loudness", action="store_true", help="also analyse the loudness of new and changed files")
+    subparser.add_argument("--workers", type=int, help="number of analysis processes")
+    subparser.set_defaults(function=command_scan)
+
+    subparser = subparsers.add_parser("replay", help="recompute all ratings from the recorded comparisons")
+    subparser.set_defaults(function=command_replay)
+
+    args = parser.parse_args()
+    trace.run(args.function, library.Library(args.library), args)
@@ -0,0 +1,224 @@
+# -------------------------------------------------------------------------------
+#  Copyright (c) 2015 Jason Lynch <jason@calindora.com>
+#
+#  Permission is hereby granted, free of charge, to any person obtaining a copy
+#  of this software and associated documentation files (the "Software"), to deal
+#  in the Software without restriction, including without limitation the rights
+#  to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+#  copies of the Software, and to permit persons to whom the Software is
+#  furnished to do so, subject to the following conditions:
+#
+#  The above copyright notice and this permission notice shall be included in
+#  all copies or substantial portions of the Software.
+#
+#  THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+#  IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+#  FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+#  AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+#  LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+#  OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+#  SOFTWARE.
+# -------------------------------------------------------------------------------
+# type: ignore
+
+import array
+import mmap
+import os
+import struct
+
+#
+# Constants
+#
+
+# The snapshot is a fixed header followed by one block per column. Every column
+# holds eight-byte items, so a column starts at HEADER_SIZE + index * capacity * 8.
+MAGIC = b"JEFFCMP2"
+HEADER = struct.Struct("=8sQqQQ")
+HEADER_SIZE = 64
+
+COLUMNS = [("first", "q"), ("second", "q"), ("score", "d"), ("timestamp", "d"), ("batch", "q")]
+ITEM_SIZE = 8
+
+MINIMUM_CAPACITY = 4096
+
+#
+# Classes
+#
+
+
+class ComparisonStore(object):
+    def __init__(self, db, path):
+        self._db = db
+        self._path = path
+
+        self._mmap = None
+        self._count = 0
+        self._max_id = 0
+        self._capacity = 0
+        self._ordered = True
+
+        self._load()
+
+    #
+    # Properties
+    #
+
+    @property
+    def first(self):
+        return self._column(0)
+
+    @property
+    def second(self):
+        return self._column(1)
+
+    @property
+    def score(self):
+        return self._column(2)
+
+    @property
+    def timestamp(self):
+        return self._column(3)
+
+    @property
+    def batch(self):
+        return self._column(4)
+
+    def __len__(self):
+        return self._count
+
+    #
+    # Public Methods
+    #
+
+    def invalidate(self):
+        # Forces the next sync() to reload every row, for when existing comparisons were modified in place. The header
+        # is rewritten too, so another process loading the file before that sync does not trust the stale rows.
+        self._count, self._max_id = 0, 0
+        self._ordered = True
+
+        if self._mmap is not None:
+            self._write_header()
+
+    def order(self):
+        if self._ordered:
+            return range(self._count)
+
+        timestamp = self.timestamp
+        return sorted(range(self._count), key=timestamp.__getitem__)
+
+    def sync(self):
+        count, max_id = self._db.execute("SELECT COUNT(*), IFNULL(MAX(id), 0) FROM comparisons;").fetchone()
+
+        if count == self._count and max_id == self._max_id:
+            return
+
+        prefix = self._db.execute("SELECT COUNT(*) FROM comparisons WHERE id <= ?;", (self._max_id,)).fetchone()[0]
+
+        if self._mmap is not None and prefix == self._count:
+            self._extend(self._fetch(self._max_id))
+        else:
+            self._count, self._max_id = 0, 0
+            self._ordered = True
+            self._extend(self._fetch(0))
+
+    #
+    # Private Methods
+    #
+
+    def _column(self, index):
+        if self._mmap is None:
+            return memoryview(array.array(COLUMNS[index][1]))
+
+        start = HEADER_SIZE + index * self._capacity * ITEM_SIZE
+        return memoryview(self._mmap)[start : start + self._count * ITEM_SIZE].cast(COLUMNS[index][1])
+
+    def _extend(self, rows):
+        columns = [array.array(typecode) for _, typecode in COLUMNS]
+        max_id = self._max_id
+        last = self.timestamp[-1] if self._count > 0 else None
+
+        for row_id, first, second, score, timestamp, batch in rows:
+            columns[0].append(first)
+            columns[1].append(second)
+            columns[2].append(score)
+            columns[3].append(timestamp)
+            columns[4].append(batch)
+
+            if last is not None and timestamp < last:
+                self._ordered = False
+
+            last = timestamp
+            max_id = row_id
+
+        added = len(columns[0])
+
+        if self._mmap is None or self._count + added > self._capacity:
+            self._rewrite(columns, max(MINIMUM_CAPACITY, 2 * (self._count + added)))
+        else:
+            for index, column in enumerate(columns):
+                start = HEADER_SIZE + (index * self._capacity + self._count) * ITEM_SIZE
+                self._mmap[start : start + added * ITEM_SIZE] = column.tobytes()
+
+        self._count += added
+        self._max_id = max_id
+        self._write_header()
+
+    def _fetch(self, after_id):
+        # Plain tuples are far cheaper than sqlite3.Row for this many rows.
+        cursor = self._db.cursor()
+        cursor.row_factory = None
+
+        return cursor.execute(
+            """
+            SELECT id, first_track_id, second_track_id, score, IFNULL(julianday(timestamp), 0.0), IFNULL(batch, 0)
+            FROM comparisons WHERE id > ? ORDER BY id ASC;
+            """,
+            (after_id,),
+        )
+
+    def _load(self):
+        try:
+            with open(self._path, "r+b") as f:
+                if os.fstat(f.fileno()).st_size < HEADER_SIZE:
+                    return
+
+                mapping = mmap.mmap(f.fileno(), 0)
+        except OSError:
+            return
+
+        magic, count, max_id, capacity, ordered = HEADER.unpack_from(mapping)
+
+        if magic != MAGIC or count > capacity or len(mapping) < HEADER_SIZE + len(COLUMNS) * capacity * ITEM_SIZE:
+            mapping.close()
+            return
+
+        self._mmap = mapping
+        self._count = count
+        self._max_id = max_id
+        self._capacity = capacity
+        self._ordered = bool(ordered)
+
+    def _rewrite(self, columns, capacity):
+        # Existing data is copied out before the new file replaces the old one. Views handed out
+        # earlier keep the previous mapping alive until they are released.
+        old = [self._column(index) for index in range(len(COLUMNS))]
+        temporary_path = "{}.tmp".format(self._path)
+
+        with open(temporary_path, "w+b") as f:
+            f.truncate(HEADER_SIZE + len(COLUMNS) * capacity * ITEM_SIZE)
+
+            for index, column in enumerate(columns):
+                f.seek(HEADER_SIZE + index * capacity * ITEM_SIZE)
+                f.write(old[index])
+                f.write(column.tobytes())
+
+            f.flush()
+            mapping = mmap.mmap(f.fileno(), 0)
+
+        os.replace(temporary_path, self._path)
+
+        self._mmap = mapping
+        self._capacity = capacity
+
+    def _write_header(self):
+        HEADER.pack_into(self._mmap, 0, MAGIC, self._count, self._max_id, self._capacity, int(self._ordered))
@@ -22,9 +22,11 @@
 
 import os
 import sys
+import threading
+import time
 import xdg.BaseDirectory
 
-from collections import deque
+from collections import OrderedDict, deque
 from typing import Any
 
 import gi
@@ -39,6 +41,16 @@ from gi.repository import Gst
 from gi.repository import Gtk
 
 from . import library
+from . import trace
+
+
+#
+# Constants
+#
+
+# The ranking view loads rows from the database in pages of this size and keeps only this many pages in memory.
+RANKING_PAGE_SIZE = 200
+RANKING_PAGE_CACHE = 16
 
 
 #
@@ -83,6 +95,12 @@ class Application(Gtk.Application):
                             <attribute name="action">app.scan_directories</attribute>
                         </item>
                     </section>
+                    <section>
+                        <item>
+                            <attribute name="label" translatable="yes">_Ranking</attribute>
+                            <attribute name="action">app.show_ranking</attribute>
+                        </item>
+                    </section>
                     <section>
                         <item>
                             <attribute name="label" translatable="yes">_Quit</attribute>
@@ -98,6 +116,7 @@ class Application(Gtk.Application):
 
         self._add_action("add_directory", self.on_action_add_directory)
         self._add_action("scan_directories", self.on_action_scan_directories)
+        self._add_action("show_ranking", self.on_action_show_ranking)
         self._add_action("quit", self.on_action_quit)
 
     def on_action_add_directory(self, action, user_data):
@@ -106,6 +125,9 @@ class Application(Gtk.Application):
     def on_action_scan_directories(self, action, user_data):
         self._window.scan_directories()
 
+    def on_action_show_ranking(self, action, user_data):
+        self._window.show_ranking()
+
     def on_action_quit(self, action, user_data):
         self._window.destroy()
 
@@ -127,18 +149,30 @@ class MainWindow(Gtk.ApplicationWindow):
         self._create_widgets()
         self._initialize_player()
 
-        self._library = library.Library(os.path.join(xdg.BaseDirectory.save_config_path("jeff"), "library.sqlite"))
-        self._library.scan_directories()
+        self._library = None
 
-        self._current_Track = None
+        self._current_track = None
         self._preview_state = None
+        self._choices = []
+        self._search_track = None
 
         self._disable_seek_updates = False
+        self._first_audio = False
+        self._state_requested = None
 
         self._queue = deque()
-        self.skip_forward()
 
-        self._update_choices()
+        # Entries handed to the player from about-to-finish: the fallback used when the queue is empty, the entry
+        # and URI prepared for the handler, and the one whose stream is about to start. The handler runs on a
+        # streaming thread, so the last two are only accessed under the lock.
+        self._next_entry = None
+        self._prepared_entry = None
+        self._pending_entry = None
+        self._entry_lock = threading.Lock()
+
+        # The library is opened and scanned only once the window has been painted, so startup shows
+        # the window immediately instead of waiting for the scan.
+        self._first_draw_handler = self.connect("draw", self.on_first_draw)
 
         GObject.timeout_add(500, self.on_timeout_update)
 
@@ -147,6 +181,9 @@ class MainWindow(Gtk.ApplicationWindow):
     # ---------------------------------------------------------------------------
 
     def add_directory(self):
+        if not self._library:
+            return
+
         dialog = Gtk.FileChooserDialog(
             "Add Directory to Library",
             self,
@@ -171,9 +208,20 @@ class MainWindow(Gtk.ApplicationWindow):
         self._update_choices()
 
     def scan_directories(self):
+        if not self._library:
+            return
+
         self._library.scan_directories()
         self._update_choices()
 
+    def show_ranking(self):
+        if not self._library:
+            return
+
+        window = RankingWindow(self._library)
+        window.set_transient_for(self)
+        window.show_all()
+
     def skip_forward(self):
         if self._preview_state:
             self._preview_end()
@@ -185,30 +233,22 @@ class MainWindow(Gtk.ApplicationWindow):
 
         track, losing_tracks = self._queue.popleft()
 
-        self._library.update_playing(track, losing_tracks)
+        with self._entry_lock:
+            self._pending_entry = None
 
-        state = self._player.get_state(Gst.CLOCK_TIME_NONE)[1]
-        self._switch_track(track, state)
-
-        self._widget_button_playpause.set_sensitive(True)
-        self._widget_button_skip_forward.set_sensitive(True)
-
-        self._update_seek_bar()
-        self._update_choices()
+        self._switch_track(track, self._get_target_state())
+        self._start_track(track, losing_tracks)
 
         return True
 
     def playpause(self):
-        if self._player.get_state(Gst.CLOCK_TIME_NONE)[1] == Gst.State.PLAYING:
-            self._player.set_state(Gst.State.PAUSED)
+        if self._get_target_state() == Gst.State.PLAYING:
+            self._set_player_state(Gst.State.PAUSED)
         else:
-            self._player.set_state(Gst.State.PLAYING)
-
-        self._player.get_state(Gst.CLOCK_TIME_NONE)
+            self._set_player_state(Gst.State.PLAYING)
 
     def stop(self):
-        self._player.set_state(Gst.State.READY)
-        self._player.get_state(Gst.CLOCK_TIME_NONE)
+        self._set_player_state(Gst.State.READY)
 
     # ---------------------------------------------------------------------------
     # Signal Handlers
@@ -220,20 +260,23 @@ class MainWindow(Gtk.ApplicationWindow):
                 if not widget.get_active():
                     self._preview_end()
             else:
-                other_widget = self._widget_choices[self._preview_state[0]]["preview"]
+                other_widget = self._get_preview_button(self._preview_state[0])
                 other_widget.handler_block_by_func(self.on_button_choices_preview_toggled)
                 other_widget.set_active(False)
                 other_widget.handler_unblock_by_func(self.on_button_choices_preview_toggled)
 
-                self._preview_state = (index, self._preview_state[1], self._preview_state[2], self._preview_state[3])
-                self._switch_track(self._choices[index])
+                self._rewind_preview(self._preview_state[0])
+                self._preview_state = (index, self._preview_state[1])
+                self._preview_players[index].set_state(Gst.State.PLAYING)
         else:
-            state = self._player.get_state(Gst.CLOCK_TIME_NONE)[1]
-            track = self._current_track
-            position = self._player.query_position(Gst.Format.TIME)[1]
+            # The main player is only paused, so it resumes exactly where it was once the preview ends.
+            state = self._get_target_state()
+
+            if state == Gst.State.PLAYING:
+                self._set_player_state(Gst.State.PAUSED)
 
-            self._preview_state = (index, track, state, position)
-            self._switch_track(self._choices[index])
+            self._preview_state = (index, state)
+            self._preview_players[index].set_state(Gst.State.PLAYING)
 
     def on_button_choices_enqueue_clicked(self, widget, index):
         if self._preview_state:
@@ -241,6 +284,7 @@ class MainWindow(Gtk.ApplicationWindow):
 
         choice = self._choices.pop(index)
         self._queue.append((choice, self._choices))
+        self._prepare_next_entry()
         self._update_choices()
 
     def on_button_playpause_clicked(self, widget):
@@ -255,16 +299,100 @@ class MainWindow(Gtk.ApplicationWindow):
     def on_button_skip_forward_clicked(self, widget):
         self.skip_forward()
 
+    def on_first_draw(self, widget, context):
+        self.disconnect(self._first_draw_handler)
+        trace.event("startup.first_frame")
+
+        GLib.idle_add(self._load_library)
+        return False
+
+    def on_player_about_to_finish(self, player):
+        # Called from a streaming thread, so this only hands over the entry and URI the main thread prepared. The
+        # queue is left alone; the comparison is recorded and the entry dequeued once the stream actually starts.
+        with self._entry_lock:
+            prepared = self._prepared_entry
+            self._pending_entry = prepared[0] if prepared else None
+
+        if prepared:
+            player.set_property("uri", prepared[1])
+
     def on_player_eos(self, bus, message):
-        if self._preview_state:
-            self._preview_end()
-        else:
-            self.skip_forward()
+        self.skip_forward()
 
     def on_player_state_changed(self, bus, message):
-        _, state, _ = message.parse_state_changed()
+        _, state, pending = message.parse_state_changed()
         self._update_buttons(state)
 
+        if message.src == self._player and pending == Gst.State.VOID_PENDING and self._state_requested:
+            name = "gst.state_change.{}".format(Gst.Element.state_get_name(state).lower())
+            trace.record(name, time.perf_counter() - self._state_requested)
+            self._state_requested = None
+
+        if state == Gst.State.PLAYING and not self._first_audio and message.src == self._player:
+            self._first_audio = True
+            trace.event("startup.first_audio")
+
+    def on_player_stream_start(self, bus, message):
+        with self._entry_lock:
+            entry, self._pending_entry = self._pending_entry, None
+
+        if not entry:
+            return
+
+        if self._queue and self._queue[0] is entry:
+            self._queue.popleft()
+
+        # The stream was queued gaplessly, so its gain is only applied once it actually starts.
+        self._player.set_property("volume", entry[0].volume)
+
+        self._current_track = entry[0]
+        self._widget_playing.set_label(entry[0].description)
+        self._widget_playing_2.set_label(entry[0].path)
+
+        self._start_track(*entry)
+
+    def on_preview_eos(self, bus, message):
+        if self._preview_state:
+            self._preview_end()
+
+    def on_search_changed(self, widget):
+        if not self._library:
+            return
+
+        self._widget_search_results.clear()
+
+        for row in self._library.search(widget.get_text()):
+            self._widget_search_results.append(
+                [row["id"], format_description(row), row["rating"], row["comparisons"], row["path"]]
+            )
+
+    def on_search_enqueue_clicked(self, widget):
+        if self._search_track:
+            self._queue.append((self._search_track, []))
+            self._prepare_next_entry()
+
+    def on_search_row_activated(self, view, path, column):
+        self.on_search_enqueue_clicked(view)
+
+    def on_search_selection_changed(self, selection):
+        if self._preview_state and self._preview_state[0] == len(self._widget_choices):
+            self._preview_end()
+
+        model, iter_ = selection.get_selected()
+        self._search_track = self._library.get_track_by_id(model[iter_][0]) if iter_ else None
+
+        self._widget_search_preview.set_sensitive(self._search_track is not None)
+        self._widget_search_enqueue.set_sensitive(self._search_track is not None)
+
+        # The selected result is prerolled like the choices so that previewing it starts immediately.
+        player = self._preview_players[len(self._widget_choices)]
+        player.set_state(Gst.State.NULL)
+
+        if self._search_track:
+            player.set_property("uri", self._search_track.uri)
+            player.set_property("volume", self._search_track.volume)
+            player.set_state(Gst.State.PAUSED)
+
     def on_seek_bar_button_pressed(self, scale, event):
         self._disable_seek_updates = True
 
@@ -294,6 +422,49 @@ class MainWindow(Gtk.ApplicationWindow):
 
         return button
 
+    def _create_choices(self, count):
+        # The number of choices comes from the library's configuration, so the rows are only built once it is open.
+        self._preview_players = []
+
+        for i in range(count):
+            widgets = {}
+
+            inner_box = Gtk.HBox(spacing=3)
+            self._widget_choices_box.pack_start(inner_box, True, True, 0)
+
+            widgets["preview"] = Gtk.ToggleButton("Preview")
+            widgets["preview"].set_sensitive(False)
+            widgets["preview"].connect("toggled", self.on_button_choices_preview_toggled, i)
+
+            widgets["enqueue"] = Gtk.Button("Enqueue")
+            widgets["enqueue"].set_sensitive(False)
+            widgets["enqueue"].connect("clicked", self.on_button_choices_enqueue_clicked, i)
+
+            widgets["label"] = Gtk.Label()
+
+            inner_box.pack_start(widgets["preview"], False, False, 0)
+            inner_box.pack_start(widgets["enqueue"], False, False, 0)
+            inner_box.pack_start(widgets["label"], False, False, 0)
+            inner_box.show_all()
+
+            self._widget_choices.append(widgets)
+
+            # Each choice gets its own player, kept prerolled in PAUSED so previews start without any setup.
+            self._preview_players.append(self._create_preview_player("preview-{}".format(i)))
+
+        # The selected search result previews through one more player, after those of the choices.
+        self._preview_players.append(self._create_preview_player("preview-search"))
+        self._widget_search_preview.connect("toggled", self.on_button_choices_preview_toggled, count)
+
+    def _create_preview_player(self, name):
+        player = Gst.ElementFactory.make("playbin", name)
+
+        bus = player.get_bus()
+        bus.add_signal_watch()
+        bus.connect("message::eos", self.on_preview_eos)
+
+        return player
+
     def _create_images(self):
         self._image_play = Gtk.Image.new_from_icon_name("media-playback-start", Gtk.IconSize.BUTTON)
         self._image_pause = Gtk.Image.new_from_icon_name("media-playback-pause", Gtk.IconSize.BUTTON)
@@ -353,32 +524,50 @@ class MainWindow(Gtk.ApplicationWindow):
         frame = Gtk.Frame(label="Choices")
         main_box.pack_start(frame, True, True, 0)
 
-        box = Gtk.VBox(spacing=3, border_width=5)
-        frame.add(box)
+        self._widget_choices_box = Gtk.VBox(spacing=3, border_width=5)
+        frame.add(self._widget_choices_box)
 
         self._widget_choices = []
 
-        for i in range(2):
-            widgets = {}
+        frame = Gtk.Frame(label="Search")
+        main_box.pack_start(frame, True, True, 0)
 
-            inner_box = Gtk.HBox(spacing=3)
-            box.pack_start(inner_box, True, True, 0)
+        vbox = Gtk.VBox(spacing=3, border_width=5)
+        frame.add(vbox)
 
-            widgets["preview"] = Gtk.ToggleButton("Preview")
-            widgets["preview"].set_sensitive(False)
-            widgets["preview"].connect("toggled", self.on_button_choices_preview_toggled, i)
+        box = Gtk.HBox(spacing=3)
+        vbox.pack_start(box, False, False, 0)
 
-            widgets["enqueue"] = Gtk.Button("Enqueue")
-            widgets["enqueue"].set_sensitive(False)
-            widgets["enqueue"].connect("clicked", self.on_button_choices_enqueue_clicked, i)
+        self._widget_search = Gtk.SearchEntry()
+        self._widget_search.set_sensitive(False)
+        self._widget_search.connect("search-changed", self.on_search_changed)
 
-            widgets["label"] = Gtk.Label()
+        self._widget_search_preview = Gtk.ToggleButton("Preview")
+        self._widget_search_preview.set_sensitive(False)
 
-            inner_box.pack_start(widgets["preview"], False, False, 0)
-            inner_box.pack_start(widgets["enqueue"], False, False, 0)
-            inner_box.pack_start(widgets["label"], False, False, 0)
+        self._widget_search_enqueue = Gtk.Button("Enqueue")
+        self._widget_search_enqueue.set_sensitive(False)
+        self._widget_search_enqueue.connect("clicked", self.on_search_enqueue_clicked)
 
-            self._widget_choices.append(widgets)
+        box.pack_start(self._widget_search, True, True, 0)
+        box.pack_start(self._widget_search_preview, False, False, 0)
+        box.pack_start(self._widget_search_enqueue, False, False, 0)
+
+        # Track id, description, rating, comparisons and path of each result. The path is shown as a tooltip.
+        self._widget_search_results = Gtk.ListStore(int, str, float, int, str)
+
+        view = Gtk.TreeView(model=self._widget_search_results)
+        view.set_tooltip_column(4)
+        view.append_column(Gtk.TreeViewColumn("Track", Gtk.CellRendererText(), text=1))
+        view.append_column(Gtk.TreeViewColumn("Rating", Gtk.CellRendererText(), text=2))
+        view.append_column(Gtk.TreeViewColumn("Comparisons", Gtk.CellRendererText(), text=3))
+        view.connect("row-activated", self.on_search_row_activated)
+        view.get_selection().connect("changed", self.on_search_selection_changed)
+
+        scrolled_window = Gtk.ScrolledWindow()
+        scrolled_window.set_size_request(-1, 150)
+        scrolled_window.add(view)
+        vbox.pack_start(scrolled_window, True, True, 0)
 
     def _format_time(self, nanoseconds):
         seconds = int(nanoseconds / 1000000000 + 0.5)
@@ -389,6 +578,16 @@ class MainWindow(Gtk.ApplicationWindow):
         else:
             return "{:d}:{:02d}".format(minutes, seconds % 60)
 
+    def _get_preview_button(self, index):
+        if index < len(self._widget_choices):
+            return self._widget_choices[index]["preview"]
+        else:
+            return self._widget_search_preview
+
+    def _get_target_state(self):
+        _, state, pending = self._player.get_state(0)
+        return state if pending == Gst.State.VOID_PENDING else pending
+
     def _initialize_player(self):
         self._player = Gst.ElementFactory.make("playbin", "player")
 
@@ -396,18 +595,71 @@ class MainWindow(Gtk.ApplicationWindow):
         bus.add_signal_watch()
         bus.connect("message::eos", self.on_player_eos)
         bus.connect("message::state-changed", self.on_player_state_changed)
+        bus.connect("message::stream-start", self.on_player_stream_start)
+
+        self._player.connect("about-to-finish", self.on_player_about_to_finish)
+
+    def _load_library(self):
+        self._library = library.Library(os.path.join(xdg.BaseDirectory.save_config_path("jeff"), "library.sqlite"))
+        trace.event("startup.library_opened")
+
+        self._create_choices(self._library.get_choice_count())
+        self._widget_search.set_sensitive(True)
+        self._library.scan_directories()
+
+        self.skip_forward()
+        self._update_choices()
+        trace.event("startup.library_loaded")
+
+        return False
+
+    def _prepare_next_entry(self):
+        # Runs on the main thread whenever the queue or the fallback changes.
+        entry = self._queue[0] if self._queue else self._next_entry
+        prepared = (entry, entry[0].uri) if entry else None
+
+        with self._entry_lock:
+            self._prepared_entry = prepared
 
     def _preview_end(self):
-        self._switch_track(self._preview_state[1], self._preview_state[2], self._preview_state[3])
+        index, state = self._preview_state
         self._preview_state = None
 
-        for widgets in self._widget_choices:
-            widgets["preview"].handler_block_by_func(self.on_button_choices_preview_toggled)
-            widgets["preview"].set_active(False)
-            widgets["preview"].handler_unblock_by_func(self.on_button_choices_preview_toggled)
+        self._rewind_preview(index)
+
+        if state == Gst.State.PLAYING:
+            self._set_player_state(Gst.State.PLAYING)
+
+        for button in [widgets["preview"] for widgets in self._widget_choices] + [self._widget_search_preview]:
+            button.handler_block_by_func(self.on_button_choices_preview_toggled)
+            button.set_active(False)
+            button.handler_unblock_by_func(self.on_button_choices_preview_toggled)
+
+    def _rewind_preview(self, index):
+        player = self._preview_players[index]
+        player.set_state(Gst.State.PAUSED)
+        player.seek_simple(Gst.Format.TIME, Gst.SeekFlags.FLUSH | Gst.SeekFlags.ACCURATE, 0)
+
+    def _set_player_state(self, state):
+        self._state_requested = time.perf_counter()
+        self._player.set_state(state)
+
+    def _start_track(self, track, losing_tracks):
+        self._library.update_playing(track, losing_tracks)
+
+        self._widget_button_playpause.set_sensitive(True)
+        self._widget_button_skip_forward.set_sensitive(True)
+
+        self._update_seek_bar()
+        self._update_choices()
+
+        # Prepare the track to fall back on if nothing is enqueued by the time this one finishes.
+        tracks = self._library.get_next_tracks(1)
+        self._next_entry = (tracks[0], []) if len(tracks) > 0 else None
+        self._prepare_next_entry()
 
-    def _switch_track(self, track, state=Gst.State.PLAYING, position=None):
-        self._player.set_state(Gst.State.NULL)
+    def _switch_track(self, track, state=Gst.State.PLAYING):
+        self._set_player_state(Gst.State.NULL)
         self._update_buttons(Gst.State.PAUSED)
         self._current_track = track
 
@@ -416,14 +668,8 @@ class MainWindow(Gtk.ApplicationWindow):
             self._widget_playing_2.set_label(track.path)
 
             self._player.set_property("uri", track.uri)
-
-            if position:
-                self._player.set_state(Gst.State.PAUSED)
-                self._player.get_state(Gst.CLOCK_TIME_NONE)
-                self._player.seek_simple(Gst.Format.TIME, Gst.SeekFlags.FLUSH | Gst.SeekFlags.KEY_UNIT, position)
-
-            self._player.set_state(state)
-            self._player.get_state(Gst.CLOCK_TIME_NONE)
+            self._player.set_property("volume", track.volume)
+            self._set_player_state(state)
         else:
             self._widget_playing.set_label("")
             self._widget_playing_2.set_label("")
@@ -441,16 +687,29 @@ class MainWindow(Gtk.ApplicationWindow):
             self._widget_button_playpause.set_image(self._image_pause)
 
     def _update_choices(self):
-        self._choices = self._library.get_next_tracks()
+        if self._preview_state:
+            self._preview_end()
+
+        self._choices = self._library.get_next_tracks(len(self._widget_choices))
+
+        for index, widgets in enumerate(self._widget_choices):
+            choice = self._choices[index] if index < len(self._choices) else None
+
+            widgets["label"].set_label(choice.description if choice else "")
+            widgets["preview"].set_sensitive(choice is not None)
+            widgets["enqueue"].set_sensitive(choice is not None)
 
-        for index, choice in enumerate(self._choices):
-            self._widget_choices[index]["label"].set_label(choice.description)
-            self._widget_choices[index]["preview"].set_sensitive(True)
-            self._widget_choices[index]["enqueue"].set_sensitive(True)
+            player = self._preview_players[index]
+            player.set_state(Gst.State.NULL)
+
+            if choice:
+                player.set_property("uri", choice.uri)
+                player.set_property("volume", choice.volume)
+                player.set_state(Gst.State.PAUSED)
 
     def _update_queue(self):
         if len(self._queue) == 0:
-            tracks = self._library.get_next_tracks()
+            tracks = self._library.get_next_tracks(1)
 
             if len(tracks) > 0:
                 self._queue.append((tracks[0], []))
@@ -471,6 +730,201 @@ class MainWindow(Gtk.ApplicationWindow):
                 self._widget_seek_bar.set_value(0.0)
 
 
+class RankingModel(GObject.Object, Gtk.TreeModel):
+    # A flat model over every track in rank order. Rows are fetched a page at a time with keyset pagination as
+    # the view asks for them, so only the pages around the viewport are ever loaded.
+    COLUMN_TYPES = [GObject.TYPE_INT, GObject.TYPE_STRING, GObject.TYPE_DOUBLE, GObject.TYPE_DOUBLE, GObject.TYPE_INT]
+
+    def __init__(self, library):
+        GObject.Object.__init__(self)
+
+        self._library = library
+        self._count = library.get_ranking_size()
+        self._pages = OrderedDict()
+        self._keys = {}
+        self._stamp = id(self) & 0x7FFFFFFF
+
+    # ---------------------------------------------------------------------------
+    # Gtk.TreeModel Methods
+    # ---------------------------------------------------------------------------
+
+    def do_get_column_type(self, column):
+        return self.COLUMN_TYPES[column]
+
+    def do_get_flags(self):
+        return Gtk.TreeModelFlags.LIST_ONLY | Gtk.TreeModelFlags.ITERS_PERSIST
+
+    def do_get_iter(self, path):
+        return self._create_iter(path.get_indices()[0])
+
+    def do_get_n_columns(self):
+        return len(self.COLUMN_TYPES)
+
+    def do_get_path(self, iter_):
+        return Gtk.TreePath.new_from_indices([iter_.user_data - 1])
+
+    def do_get_value(self, iter_, column):
+        index = iter_.user_data - 1
+        row = self._get_row(index)
+
+        if column == 0:
+            return index + 1
+        elif row is None:
+            return "" if column == 1 else 0
+        elif column == 1:
+            return format_description(row)
+        elif column == 2:
+            return row["rating"]
+        elif column == 3:
+            return row["deviation"]
+        else:
+            return row["comparisons"]
+
+    def do_iter_children(self, parent):
+        return self._create_iter(0) if parent is None else (False, None)
+
+    def do_iter_has_child(self, iter_):
+        return False
+
+    def do_iter_n_children(self, iter_):
+        return self._count if iter_ is None else 0
+
+    def do_iter_next(self, iter_):
+        if iter_.user_data < self._count:
+            iter_.user_data += 1
+            return True, iter_
+
+        return False, None
+
+    def do_iter_nth_child(self, parent, n):
+        return self._create_iter(n) if parent is None else (False, None)
+
+    def do_iter_parent(self, child):
+        return False, None
+
+    # ---------------------------------------------------------------------------
+    # Private Methods
+    # ---------------------------------------------------------------------------
+
+    def _create_iter(self, index):
+        if index < 0 or index >= self._count:
+            return False, None
+
+        # user_data is offset by one so that the first row is not a NULL pointer.
+        iter_ = Gtk.TreeIter()
+        iter_.stamp = self._stamp
+        iter_.user_data = index + 1
+
+        return True, iter_
+
+    def _get_row(self, index):
+        page, offset = divmod(index, RANKING_PAGE_SIZE)
+
+        if page in self._pages:
+            self._pages.move_to_end(page)
+        else:
+            # Sequential scrolling continues from the key of the previous page; a jump looks its key up first.
+            if page > 0 and page not in self._keys:
+                self._keys[page] = self._library.get_ranking_key(page * RANKING_PAGE_SIZE - 1)
+
+            rows = self._library.get_ranking_page(self._keys.get(page), RANKING_PAGE_SIZE)
+            self._pages[page] = rows
+
+            if len(rows) > 0:
+                self._keys[page + 1] = (rows[-1]["rating"], rows[-1]["id"])
+
+            if len(self._pages) > RANKING_PAGE_CACHE:
+                self._pages.popitem(last=False)
+
+        rows = self._pages[page]
+        return rows[offset] if offset < len(rows) else None
+
+
+class RankingWindow(Gtk.Window):
+    def __init__(self, library):
+        Gtk.Window.__init__(self, title="Ranking")
+        self.set_default_size(800, 600)
+
+        self._model = RankingModel(library)
+
+        self._create_widgets()
+
+    # ---------------------------------------------------------------------------
+    # Signal Handlers
+    # ---------------------------------------------------------------------------
+
+    def on_jump_activate(self, widget):
+        rank = widget.get_value_as_int()
+
+        if rank > 0:
+            path = Gtk.TreePath.new_from_indices([rank - 1])
+            self._widget_view.scroll_to_cell(path, None, True, 0.0, 0.0)
+            self._widget_view.set_cursor(path, None, False)
+
+    # ---------------------------------------------------------------------------
+    # Private Methods
+    # ---------------------------------------------------------------------------
+
+    def _create_column(self, title, column, width, format_string="{}"):
+        renderer = Gtk.CellRendererText()
+        view_column = Gtk.TreeViewColumn(title, renderer)
+        view_column.set_cell_data_func(renderer, self._format_cell, (column, format_string))
+
+        # Fixed sizing lets the view lay out rows without asking the model for every one of them.
+        view_column.set_sizing(Gtk.TreeViewColumnSizing.FIXED)
+        view_column.set_fixed_width(width)
+        view_column.set_resizable(True)
+
+        return view_column
+
+    def _create_widgets(self):
+        vbox = Gtk.VBox(spacing=3, border_width=3)
+        self.add(vbox)
+
+        box = Gtk.HBox(spacing=3)
+        vbox.pack_start(box, False, False, 0)
+
+        self._widget_jump = Gtk.SpinButton.new_with_range(1, max(1, self._model.iter_n_children(None)), 1)
+        self._widget_jump.connect("activate", self.on_jump_activate)
+
+        box.pack_start(Gtk.Label("Jump to rank:"), False, False, 0)
+        box.pack_start(self._widget_jump, False, False, 0)
+
+        self._widget_view = Gtk.TreeView(model=self._model)
+        self._widget_view.set_fixed_height_mode(True)
+        self._widget_view.append_column(self._create_column("Rank", 0, 70))
+        self._widget_view.append_column(self._create_column("Track", 1, 440))
+        self._widget_view.append_column(self._create_column("Rating", 2, 90, "{:0.3f}"))
+        self._widget_view.append_column(self._create_column("Deviation", 3, 90, "{:0.3f}"))
+        self._widget_view.append_column(self._create_column("Comparisons", 4, 90))
+
+        scrolled_window = Gtk.ScrolledWindow()
+        scrolled_window.add(self._widget_view)
+        vbox.pack_start(scrolled_window, True, True, 0)
+
+    def _format_cell(self, view_column, renderer, model, iter_, data):
+        column, format_string = data
+        renderer.set_property("text", format_string.format(model.get_value(iter_, column)))
+
+
+#
+# Functions
+#
+
+
+def format_description(row):
+    # The description of a ranking or search row, built from the metadata cached in the files table.
+    if row["title"]:
+        if row["album"]:
+            return "{} - {} ({})".format(row["artist"] or "Unknown Artist", row["title"], row["album"])
+        else:
+            return "{} - {}".format(row["artist"] or "Unknown Artist", row["title"])
+    elif row["path"]:
+        return os.path.split(row["path"])[1]
+    else:
+        return ""
+
+
 def run():
     application = Application()
-    application.run(sys.argv)
+    trace.run(application.run, sys.argv)
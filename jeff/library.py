@@ -21,28 +21,169 @@
 # -------------------------------------------------------------------------------
 # type: ignore
 
+import array
+import concurrent.futures
 import datetime
+import hashlib
 import math
+import mmap
+import multiprocessing
 import os
+import random
 import sqlite3
-import time
-
-import choix
-import mutagen
 
 from gi.repository import GLib
 
+from . import comparisons
+from . import trace
+
 #
 # Constants
 #
 
 EXTENSIONS = ["flac", "m4a", "mp3", "ogg", "wav", "wma"]
 
-base_time = time.time()
+# Number of tracks offered per choice unless the config table says otherwise.
+CHOICE_COUNT = 2
+
+# Opponents are drawn from tracks rated within this distance of the least compared track.
+CHOICE_WINDOW = 250
+
+# Imported comparisons are inserted and committed in transactions of this many rows.
+IMPORT_BATCH_SIZE = 50000
+
+# Number of results returned by search() unless the caller asks for more.
+SEARCH_LIMIT = 100
+
+# Searches matching at least this many files are returned unranked, since ranking scores every match.
+SEARCH_RANK_LIMIT = 1000
+
+# Bump whenever the cached per-file metadata gains a field, so the next scan refreshes existing rows.
+METADATA_VERSION = 3
+
+# Julian day number of 2000-01-01 12:00, used to convert SQLite julianday() values.
+JULIAN_EPOCH = (datetime.datetime(2000, 1, 1, 12), 2451545.0)
+
+
+def read_tags(path):
+    # mutagen is imported on first use so that starting the GUI does not pay for it.
+    import mutagen
+
+    with trace.span("mutagen.parse"):
+        return mutagen.File(path, easy=True)
+
+
+def get_audio_range(data):
+    # Tag blocks are excluded so that files differing only in their tags hash the same. Formats that interleave
+    # tags with audio (MP4, Ogg) are hashed whole and only match exact copies.
+    start, end = 0, len(data)
+
+    while data[start : start + 3] == b"ID3" and end - start >= 10:
+        size = (data[start + 6] << 21) | (data[start + 7] << 14) | (data[start + 8] << 7) | data[start + 9]
+        start += 10 + size + (10 if data[start + 5] & 0x10 else 0)
+
+    if data[start : start + 4] == b"fLaC":
+        start += 4
+
+        while start + 4 <= end:
+            header = data[start]
+            start += 4 + int.from_bytes(data[start + 1 : start + 4], "big")
+
+            if header & 0x80:
+                break
+
+    if end - start >= 128 and data[end - 128 : end - 125] == b"TAG":
+        end -= 128
+
+    if end - start >= 32 and data[end - 32 : end - 24] == b"APETAGEX":
+        size = int.from_bytes(data[end - 20 : end - 16], "little")
+        flags = int.from_bytes(data[end - 12 : end - 8], "little")
+        end -= size + (32 if flags & 0x80000000 else 0)
+
+    return min(start, len(data)), max(min(start, len(data)), end)
+
+
+def hash_audio(path):
+    try:
+        with open(path, "rb") as f:
+            if os.fstat(f.fileno()).st_size == 0:
+                return hashlib.sha1().hexdigest()
+
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as data:
+                start, end = get_audio_range(data)
+
+                with memoryview(data)[start:end] as view:
+                    return hashlib.sha1(view).hexdigest()
+    except OSError:
+        return None
+
+
+def measure_loudness(path):
+    # Runs in a worker process. Decodes the whole file through rganalysis and returns its ReplayGain track gain and
+    # peak, or None if the file cannot be decoded or the GStreamer plugins needed for the analysis are missing.
+    import gi
+
+    try:
+        gi.require_version("Gst", "1.0")
+
+        from gi.repository import Gst
+
+        Gst.init(None)
+
+        pipeline = Gst.parse_launch(
+            "filesrc name=source ! decodebin ! audioconvert ! audioresample ! rganalysis name=analysis ! fakesink"
+        )
+    except (ImportError, ValueError, GLib.Error):
+        return None
+
+    source = pipeline.get_by_name("source") if pipeline is not None else None
 
+    if source is None or pipeline.get_by_name("analysis") is None:
+        return None
 
-def print_debug(function, msg):
-    print("DEBUG: {:>20} {:12.3f} {}".format(function, time.time() - base_time, msg))
+    source.set_property("location", path)
+
+    bus = pipeline.get_bus()
+    gain, peak = None, None
+
+    pipeline.set_state(Gst.State.PLAYING)
+
+    try:
+        while True:
+            message = bus.timed_pop_filtered(
+                Gst.CLOCK_TIME_NONE, Gst.MessageType.TAG | Gst.MessageType.EOS | Gst.MessageType.ERROR
+            )
+
+            if message.type == Gst.MessageType.ERROR:
+                return None
+            elif message.type == Gst.MessageType.EOS:
+                return (gain, peak) if gain is not None else None
+            elif message.src.get_name() == "analysis":
+                # Tags read from the file itself are posted too; only the analyser's own results are used.
+                tags = message.parse_tag()
+                found, value = tags.get_double(Gst.TAG_TRACK_GAIN)
+                gain = value if found else gain
+                found, value = tags.get_double(Gst.TAG_TRACK_PEAK)
+                peak = value if found else peak
+    finally:
+        pipeline.set_state(Gst.State.NULL)
+
+
+def get_search_query(text):
+    # Every word becomes a quoted prefix term, so FTS5 operators and punctuation in the input are matched literally.
+    terms = ['"{}"*'.format(word.replace('"', '""')) for word in text.split()]
+    return " ".join(terms) if terms else None
+
+
+def get_codec(tags):
+    info = tags.info
+
+    if getattr(info, "layer", None):
+        return "mp{}".format(info.layer)
+    elif getattr(info, "codec", None):
+        return "aac" if info.codec.startswith("mp4a") else info.codec
+    else:
+        return type(tags).__name__.lower().removeprefix("easy").removeprefix("ogg")
 
 
 def update_rating(score, rating, deviation, opponent_rating, opponent_deviation):
@@ -57,6 +198,24 @@ def update_rating(score, rating, deviation, opponent_rating, opponent_deviation)
     return (r, rd)
 
 
+def update_rating_batch(rating, deviation, results):
+    # Glicko update over one rating period; results is a list of (score, opponent_rating, opponent_deviation).
+    q = math.log(10) / 400
+    d_inverse = 0.0
+    total = 0.0
+
+    for score, opponent_rating, opponent_deviation in results:
+        g = 1 / math.sqrt(1 + 3 * (q**2) * (opponent_deviation**2) / (math.pi**2))
+        e = 1 / (1 + 10 ** (-1 * g * (rating - opponent_rating) / 400))
+        d_inverse += (q**2) * (g**2) * (e * (1 - e))
+        total += g * (score - e)
+
+    r = rating + (q / (1 / (deviation**2) + d_inverse)) * total
+    rd = math.sqrt(((1 / (deviation**2)) + d_inverse) ** -1)
+
+    return (r, rd)
+
+
 #
 # Classes
 #
@@ -121,11 +280,19 @@ class Track(object):
     def path(self):
         return self._path
 
+    @property
+    def volume(self):
+        # Linear playback volume that applies the cached ReplayGain, limited so that the peak does not clip.
+        if self._gain is None:
+            return 1.0
+
+        volume = 10 ** (self._gain / 20)
+        return min(volume, 1 / self._peak) if self._peak else volume
+
     @property
     def tags(self):
         if not self._tags:
-            print(self._id, self._path)
-            self._tags = mutagen.File(self._path, easy=True)
+            self._tags = read_tags(self._path)
 
         return self._tags
 
@@ -143,15 +310,17 @@ class Track(object):
 
         if result:
             self._path = result["path"]
+            self._gain, self._peak = result["track_gain"], result["track_peak"]
         else:
             self._path = None
+            self._gain, self._peak = None, None
 
         self._tags = None
 
 
 class Library(object):
     def __init__(self, path):
-        self._db = sqlite3.connect(path, detect_types=sqlite3.PARSE_DECLTYPES)
+        self._db = trace.connect(path, detect_types=sqlite3.PARSE_DECLTYPES)
         self._db.row_factory = sqlite3.Row
 
         self._tracks = None
@@ -159,10 +328,17 @@ class Library(object):
 
         self._initialize_db()
 
+        self._comparisons = comparisons.ComparisonStore(self._db, os.path.splitext(path)[0] + ".comparisons")
+
     #
     # Properties
     #
 
+    @property
+    def comparisons(self):
+        self._comparisons.sync()
+        return self._comparisons
+
     @property
     def tracks(self):
         return {
@@ -191,16 +367,14 @@ class Library(object):
         return error ** (1 / count)
 
     @property
+    @trace.span("ranking.asm")
     def ranked_tracks_asm(self):
         base_data = {}
         data = {}
         scores = {x: 0.0 for x in self.tracks}
+        store = self.comparisons
 
-        for row in self._db.execute("SELECT * FROM comparisons ORDER BY timestamp ASC"):
-            first = row["first_track_id"]
-            second = row["second_track_id"]
-            score = row["score"]
-
+        for first, second, score in zip(store.first, store.second, store.score):
             if first not in data:
                 data[first] = {}
                 base_data[first] = {"for": 0, "against": 0, "count": 0}
@@ -233,11 +407,7 @@ class Library(object):
 
         asm_data = {}
 
-        for row in self._db.execute("SELECT * FROM comparisons ORDER BY timestamp ASC"):
-            first = row["first_track_id"]
-            second = row["second_track_id"]
-            score = row["score"]
-
+        for first, second, score in zip(store.first, store.second, store.score):
             if first not in asm_data:
                 asm_data[first] = {"for": 0, "against": 0}
 
@@ -268,22 +438,29 @@ class Library(object):
         return [(x[1], tracks[x[0]]) for x in sorted(scores.items(), key=lambda x: x[1], reverse=True)]
 
     @property
+    @trace.span("ranking.bt")
     def ranked_tracks_bt(self):
+        # choix pulls in numpy and scipy, so only load it for the one ranking that needs it.
+        import choix
+
         tracks = self.tracks
+        store = self.comparisons
         data = []
 
-        for row in self._db.execute("SELECT * FROM comparisons ORDER BY timestamp ASC"):
-            if row["score"] > 0:
-                data.append((row["first_track_id"], row["second_track_id"]))
+        for first, second, score in zip(store.first, store.second, store.score):
+            if score > 0:
+                data.append((first, second))
             else:
-                data.append((row["second_track_id"], row["first_track_id"]))
+                data.append((second, first))
 
         params = choix.ilsr_pairwise(max(tracks.keys()) + 1, data, alpha=0.0001)
         return [(params[x[0]], x[1]) for x in sorted(tracks.items(), key=lambda x: params[x[0]], reverse=True)]
 
     @property
+    @trace.span("ranking.elo")
     def ranked_tracks_elo(self):
         tracks = self.tracks
+        store = self.comparisons
         ratings = {x: 1500.0 for x in tracks.keys()}
 
         iterations = 0
@@ -293,9 +470,7 @@ class Library(object):
             expected = {x: 0 for x in tracks.keys()}
             actual = {x: 0 for x in tracks.keys()}
 
-            for row in self._db.execute("SELECT * FROM comparisons ORDER BY timestamp ASC"):
-                track_a, track_b = row["first_track_id"], row["second_track_id"]
-
+            for track_a, track_b, score in zip(store.first, store.second, store.score):
                 q_a = pow(10, ratings[track_a] / 400)
                 q_b = pow(10, ratings[track_b] / 400)
 
@@ -305,8 +480,8 @@ class Library(object):
                 expected[track_a] += e_a
                 expected[track_b] += e_b
 
-                actual[track_a] += row["score"]
-                actual[track_b] += 1 - row["score"]
+                actual[track_a] += score
+                actual[track_b] += 1 - score
 
             delta = 0
 
@@ -318,24 +493,27 @@ class Library(object):
 
             iterations += 1
 
-            print(iterations, delta)
+        trace.count("ranking.elo.iterations", iterations)
 
         return [(x[1], tracks[x[0]]) for x in sorted(ratings.items(), key=lambda x: x[1], reverse=True)]
 
     @property
+    @trace.span("ranking.best_fit")
     def ranked_tracks_best_fit(self):
         scores = {}
         ratings = {}
+        store = self.comparisons
+        first, second, score = store.first, store.second, store.score
 
-        for row in self._db.execute("SELECT * FROM comparisons ORDER BY timestamp ASC"):
-            key = row["first_track_id"], row["second_track_id"]
+        for i in store.order():
+            key = first[i], second[i]
 
             if key not in scores:
-                scores[key] = 0.5 * 0.9 + row["score"] * 0.1
-                ratings[row["first_track_id"]] = 0.5
-                ratings[row["second_track_id"]] = 0.5
+                scores[key] = 0.5 * 0.9 + score[i] * 0.1
+                ratings[first[i]] = 0.5
+                ratings[second[i]] = 0.5
             else:
-                scores[key] = scores[key] * 0.9 + row["score"] * 0.1
+                scores[key] = scores[key] * 0.9 + score[i] * 0.1
 
         tracks = self.tracks
 
@@ -344,6 +522,7 @@ class Library(object):
 
         while error > 0.1 and (not old_error or old_error != error):
             old_error = error
+            trace.count("ranking.best_fit.iterations")
             for track in ratings:
                 base = 0.0
 
@@ -392,22 +571,132 @@ class Library(object):
         self._db.execute("DELETE FROM directories WHERE path = ?;", (path,))
         self._db.commit()
 
-    def scan_directories(self):
-        self._scan_directories()
+    def scan_directories(self, loudness=False, workers=None):
+        self._scan_directories(loudness, workers)
+
+    def _scan_directories(self, loudness=False, workers=None):
+        with trace.span("scan.add_new_files"):
+            self._add_new_files()
+
+        with trace.span("scan.remove_missing_files"):
+            self._remove_missing_files()
+
+        # Decoding every file is far slower than the rest of the scan, so loudness is only analysed on request.
+        if loudness:
+            with trace.span("scan.analyze_loudness"):
+                self.analyze_loudness(workers)
 
-    def _scan_directories(self):
-        print_debug("_scan_directories", "Adding new files")
-        self._add_new_files()
-        print_debug("_scan_directories", "Removing missing files")
-        self._remove_missing_files()
-        print_debug("_scan_directories", "Done")
         self._tracks = None
         self._scanning = False
 
+    def get_best_files(self):
+        # Sizes are normally cached by the scanner; fill in any left by files not scanned since the upgrade.
+        for row in self._db.execute("SELECT id, path FROM files WHERE size IS NULL;").fetchall():
+            if os.path.exists(row["path"]):
+                self._db.execute("UPDATE files SET size = ? WHERE id = ?;", (os.path.getsize(row["path"]), row["id"]))
+
+        self._db.commit()
+
+        # FLAC files are strongly preferred: their size counts ten times when picking a track's file.
+        return {
+            row["track_id"]: row
+            for row in self._db.execute(
+                """
+                SELECT * FROM (
+                    SELECT t.*, f.*, ROW_NUMBER() OVER (
+                        PARTITION BY f.track_id
+                        ORDER BY
+                            f.size * f.priority * (CASE WHEN substr(f.path, -4) = 'flac' THEN 10 ELSE 1 END) DESC,
+                            f.id ASC
+                    ) AS position
+                    FROM tracks t, files f WHERE t.id = f.track_id
+                ) WHERE position = 1;
+                """
+            )
+        }
+
     def get_rating_range(self):
         result = self._db.execute("SELECT MAX(rating) AS max, MIN(rating) AS min FROM tracks;").fetchone()
         return (result["min"], result["max"])
 
+    def get_ranking(self, limit=None):
+        return self._db.execute(
+            """
+            SELECT * FROM (
+                SELECT t.id, t.mbid, t.rating, t.deviation, t.comparisons, f.path, ROW_NUMBER() OVER (
+                    PARTITION BY t.id ORDER BY f.priority DESC, f.id ASC
+                ) AS position
+                FROM tracks t, files f WHERE t.id = f.track_id
+            ) WHERE position = 1 ORDER BY rating DESC LIMIT ?;
+            """,
+            (-1 if limit is None else limit,),
+        ).fetchall()
+
+    def get_ranking_key(self, position):
+        # The (rating, id) key of the track at a given rank, read from the rating index alone.
+        result = self._db.execute(
+            "SELECT rating, id FROM tracks ORDER BY rating DESC, id DESC LIMIT 1 OFFSET ?;", (position,)
+        ).fetchone()
+
+        return (result["rating"], result["id"]) if result else None
+
+    def get_ranking_page(self, after=None, limit=100):
+        # Keyset pagination: rows ranked strictly below the (rating, id) key of the previous page's last row.
+        rating, track_id = after if after else (math.inf, 0)
+
+        return self._db.execute(
+            """
+            SELECT t.id, t.rating, t.deviation, t.comparisons, f.artist, f.title, f.album, f.path
+            FROM tracks t LEFT JOIN files f ON f.id = (
+                SELECT id FROM files WHERE track_id = t.id ORDER BY priority DESC LIMIT 1
+            )
+            WHERE (t.rating, t.id) < (?, ?) ORDER BY t.rating DESC, t.id DESC LIMIT ?;
+            """,
+            (rating, track_id, limit),
+        ).fetchall()
+
+    def get_ranking_size(self):
+        return self._db.execute("SELECT COUNT(*) FROM tracks;").fetchone()[0]
+
+    def find_track(self, reference):
+        # A track can be referred to by its id, its MusicBrainz id or the path of any of its files.
+        row = self._db.execute(
+            """
+            SELECT t.* FROM tracks t LEFT JOIN files f ON t.id = f.track_id
+            WHERE t.id = ? OR t.mbid = ? OR f.path = ? LIMIT 1;
+            """,
+            (reference, reference, reference),
+        ).fetchone()
+
+        return Track(self._db, row) if row else None
+
+    @trace.span("library.search")
+    def search(self, query, limit=SEARCH_LIMIT):
+        # Full-text search over the artist, title, album and path of every file. Narrow searches are returned best
+        # matches first; broad ones, such as a short prefix, stop at the first matches found.
+        match = get_search_query(query)
+
+        if not match:
+            return []
+
+        matches = self._db.execute(
+            "SELECT COUNT(*) FROM (SELECT rowid FROM files_search WHERE files_search MATCH ? LIMIT ?);",
+            (match, SEARCH_RANK_LIMIT),
+        ).fetchone()[0]
+
+        return self._db.execute(
+            """
+            SELECT t.id, t.rating, t.deviation, t.comparisons, f.artist, f.title, f.album, f.path
+            FROM files_search s, files f, tracks t
+            WHERE files_search MATCH ? AND f.id = s.rowid AND t.id = f.track_id {} LIMIT ?;
+            """.format("ORDER BY s.rank" if matches < SEARCH_RANK_LIMIT else ""),
+            (match, limit),
+        ).fetchall()
+
+    def get_track_by_id(self, track_id):
+        row = self._db.execute("SELECT * FROM tracks WHERE id = ?;", (track_id,)).fetchone()
+        return Track(self._db, row) if row else None
+
     def get_track(self, path):
         track = Track(
             self._db,
@@ -417,80 +706,397 @@ class Library(object):
         )
         return track
 
-    def get_next_tracks(self):
+    def get_choice_count(self):
+        result = self._db.execute("SELECT value FROM config WHERE key = ?;", ("choice_count",)).fetchone()
+        return int(result["value"]) if result else CHOICE_COUNT
+
+    def set_choice_count(self, count):
+        self._db.execute("INSERT OR REPLACE INTO config (key, value) VALUES (?, ?);", ("choice_count", int(count)))
+        self._db.commit()
+
+    def get_next_tracks(self, count=CHOICE_COUNT):
         # TODO: Add support for other selection algorithms. True random at least.
         #       Fix this to only pull tracks that have files.
-        count = self._db.execute("SELECT COUNT(*) AS count FROM tracks").fetchone()["count"]
+        first = self._get_random_track(
+            [], "comparisons = ?", (self._db.execute("SELECT MIN(comparisons) FROM tracks;").fetchone()[0],)
+        )
+
+        if not first:
+            return []
+
+        rows = [first]
+
+        # The rating window is split into one band per opponent so that the opponents are spread across it. Each
+        # band is entered at a random rating, which is a single seek on the tracks_rating index.
+        width = 2 * CHOICE_WINDOW / max(count - 1, 1)
+
+        for band in range(count - 1):
+            low = first["rating"] - CHOICE_WINDOW + band * width
+            row = self._seek_track(rows, low + random.random() * width, low + width)
+
+            if not row:
+                # Nothing between the random point and the top of the band, so take the lowest track in it.
+                row = self._seek_track(rows, low, low + width)
 
-        if count >= 2:
-            first = Track(
-                self._db,
+            if row:
+                rows.append(row)
+
+        while len(rows) < count:
+            row = self._get_random_track(rows)
+
+            if not row:
+                break
+
+            rows.append(row)
+
+        return [Track(self._db, row) for row in rows]
+
+    def analyze_loudness(self, workers=None, paths=None):
+        # Results are cached per file and only measured again once its size or modification time changes. Files
+        # that cannot be decoded are cached without a gain so they are not retried on every scan. If paths is given,
+        # only those files are considered.
+        pending = []
+        paths = set(paths) if paths is not None else None
+
+        for row in self._db.execute("SELECT id, path, loudness_size, loudness_mtime FROM files;").fetchall():
+            if paths is not None and row["path"] not in paths:
+                continue
+
+            try:
+                stat = os.stat(row["path"])
+            except OSError:
+                continue
+
+            if row["loudness_size"] != stat.st_size or row["loudness_mtime"] != stat.st_mtime:
+                pending.append((row["id"], row["path"], stat.st_size, stat.st_mtime))
+
+        if not pending:
+            return 0, 0
+
+        failed = 0
+
+        # GStreamer cannot be used safely in a forked copy of a process that has already started it.
+        context = multiprocessing.get_context("spawn")
+
+        with concurrent.futures.ProcessPoolExecutor(workers, mp_context=context) as executor:
+            results = executor.map(measure_loudness, [path for _, path, _, _ in pending])
+
+            for (file_id, _, size, mtime), result in zip(pending, results):
+                gain, peak = result or (None, None)
+                failed += result is None
+
+                # Committed file by file so that an interrupted run keeps what it has measured.
                 self._db.execute(
-                    "SELECT * FROM tracks WHERE comparisons = (SELECT MIN(comparisons) FROM tracks) ORDER BY RANDOM() LIMIT 1;"
-                ).fetchone(),
+                    """
+                    UPDATE files SET track_gain = ?, track_peak = ?, loudness_size = ?, loudness_mtime = ?
+                    WHERE id = ?;
+                    """,
+                    (gain, peak, size, mtime, file_id),
+                )
+                self._db.commit()
+
+        trace.count("loudness.measured", len(pending) - failed)
+        trace.count("loudness.failed", failed)
+
+        return len(pending) - failed, failed
+
+    def deduplicate(self, workers=None):
+        # Tracks are only merged for files without a MusicBrainz ID; tagged files are already matched by _add_file.
+        pending = []
+
+        for row in self._db.execute(
+            """
+            SELECT f.id, f.path, f.hash_size, f.hash_mtime FROM files f, tracks t
+            WHERE f.track_id = t.id AND t.mbid IS NULL;
+            """
+        ).fetchall():
+            try:
+                stat = os.stat(row["path"])
+            except OSError:
+                continue
+
+            if row["hash_size"] != stat.st_size or row["hash_mtime"] != stat.st_mtime:
+                pending.append((row["id"], row["path"], stat.st_size, stat.st_mtime))
+
+        with trace.span("dedupe.hash"), concurrent.futures.ProcessPoolExecutor(workers) as executor:
+            digests = executor.map(hash_audio, [path for _, path, _, _ in pending], chunksize=16)
+
+            for (file_id, _, size, mtime), digest in zip(pending, digests):
+                if digest:
+                    self._db.execute(
+                        "UPDATE files SET audio_hash = ?, hash_size = ?, hash_mtime = ? WHERE id = ?;",
+                        (digest, size, mtime, file_id),
+                    )
+
+        self._db.commit()
+
+        # Tracks sharing any audio hash are joined into one group (a track may have several files), and every
+        # group is merged onto its track with the most comparisons.
+        groups = {}
+        counts = {}
+
+        for row in self._db.execute(
+            """
+            SELECT DISTINCT f.audio_hash, t.id, t.comparisons FROM files f, tracks t
+            WHERE f.track_id = t.id AND t.mbid IS NULL AND f.audio_hash IS NOT NULL;
+            """
+        ):
+            groups.setdefault(row["audio_hash"], []).append(row["id"])
+            counts[row["id"]] = row["comparisons"]
+
+        parent = {}
+
+        def find(track_id):
+            while parent.get(track_id, track_id) != track_id:
+                track_id = parent[track_id]
+
+            return track_id
+
+        for track_ids in groups.values():
+            for track_id in track_ids[1:]:
+                parent[find(track_id)] = find(track_ids[0])
+
+        components = {}
+
+        for track_id in counts:
+            components.setdefault(find(track_id), []).append(track_id)
+
+        self._db.execute("CREATE TEMP TABLE IF NOT EXISTS merges (old INTEGER PRIMARY KEY, new INTEGER);")
+        self._db.execute("DELETE FROM temp.merges;")
+
+        for track_ids in components.values():
+            track_ids.sort(key=lambda x: (-counts[x], x))
+            self._db.executemany(
+                "INSERT INTO temp.merges (old, new) VALUES (?, ?);",
+                ((track_id, track_ids[0]) for track_id in track_ids[1:]),
             )
 
-            secondsrc = self._db.execute(
-                "SELECT * FROM tracks WHERE id != ? AND ABS(rating - ?) < 250 ORDER BY RANDOM() LIMIT 1;",
-                (first.id, first.rating),
-            ).fetchone()
+        merged = self._db.execute("SELECT COUNT(*) FROM temp.merges;").fetchone()[0]
 
-            if not secondsrc:
-                secondsrc = self._db.execute(
-                    "SELECT * FROM tracks WHERE id != ? ORDER BY RANDOM() LIMIT 1;", (first.id,)
-                ).fetchone()
+        if merged > 0:
+            self._merge_tracks()
+            self.replay_ratings()
 
-            second = Track(self._db, secondsrc)
+        return len(pending), merged
 
-            return [first, second]
-        else:
-            return []
+    def import_comparisons(self, comparisons, batch_size=IMPORT_BATCH_SIZE):
+        # Each comparison is (winner, loser, timestamp), with tracks given in any form find_track() accepts.
+        # Ratings are not touched; call replay_ratings() once the import is done.
+        lookup = {}
 
-    def update_playing(self, track, losing_tracks):
-        for losing_track in losing_tracks:
-            if track.id < losing_track.id:
-                first_track_id, second_track_id = track.id, losing_track.id
-                first_track_score = 1.0
-                second_track_score = 0.0
-            else:
-                first_track_id, second_track_id = losing_track.id, track.id
-                first_track_score = 0.0
-                second_track_score = 1.0
+        for row in self._db.execute(
+            "SELECT t.id, t.mbid, f.path FROM tracks t LEFT JOIN files f ON t.id = f.track_id;"
+        ):
+            lookup[str(row["id"])] = lookup[row["mbid"]] = lookup[row["path"]] = row["id"]
 
-            self._db.execute(
+        lookup.pop(None, None)
+
+        imported, skipped = 0, 0
+        batch = []
+
+        def flush():
+            self._db.executemany(
                 "INSERT INTO comparisons (first_track_id, second_track_id, score, timestamp) VALUES (?, ?, ?, ?);",
-                (first_track_id, second_track_id, first_track_score, datetime.datetime.now()),
+                batch,
             )
+            self._db.commit()
+            batch.clear()
 
-            first_track = self._db.execute("SELECT * FROM tracks WHERE id = ?;", (first_track_id,)).fetchone()
-            second_track = self._db.execute("SELECT * FROM tracks WHERE id = ?;", (second_track_id,)).fetchone()
+        for winner, loser, timestamp in comparisons:
+            winner, loser = lookup.get(str(winner)), lookup.get(str(loser))
 
-            first_since = (
-                (datetime.datetime.now() - first_track["last_update"]).days if first_track["last_update"] else 364
-            )
-            second_since = (
-                (datetime.datetime.now() - second_track["last_update"]).days if second_track["last_update"] else 364
-            )
+            if winner is None or loser is None or winner == loser:
+                skipped += 1
+                continue
 
-            first_deviation = min(math.sqrt(first_track["deviation"] ** 2 + (18.15682598**2) * first_since), 350)
-            second_deviation = min(math.sqrt(second_track["deviation"] ** 2 + (18.15682598**2) * second_since), 350)
+            batch.append((winner, loser, 1.0, timestamp) if winner < loser else (loser, winner, 0.0, timestamp))
+            imported += 1
 
-            first_new_rating, first_new_deviation = update_rating(
-                first_track_score, first_track["rating"], first_deviation, second_track["rating"], second_deviation
-            )
-            second_new_rating, second_new_deviation = update_rating(
-                second_track_score, second_track["rating"], second_deviation, first_track["rating"], first_deviation
-            )
+            if len(batch) >= batch_size:
+                flush()
 
-            self._db.execute(
-                "UPDATE tracks SET comparisons = comparisons + 1, rating = ?, deviation = ?, last_update = ? WHERE id = ?",
-                (first_new_rating, first_new_deviation, datetime.datetime.now(), first_track["id"]),
-            )
-            self._db.execute(
-                "UPDATE tracks SET comparisons = comparisons + 1, rating = ?, deviation = ?, last_update = ? WHERE id = ?",
-                (second_new_rating, second_new_deviation, datetime.datetime.now(), second_track["id"]),
+        flush()
+
+        return imported, skipped
+
+    @trace.span("library.replay_ratings")
+    def replay_ratings(self):
+        ids = [row["id"] for row in self._db.execute("SELECT id FROM tracks ORDER BY id;")]
+        index = {track_id: i for i, track_id in enumerate(ids)}
+
+        comparisons = array.array("q", [0]) * len(ids)
+        ratings = array.array("d", [1500.0]) * len(ids)
+        deviations = array.array("d", [350.0]) * len(ids)
+        updates = array.array("d", [math.nan]) * len(ids)
+
+        store = self.comparisons
+        first_ids, second_ids, scores, timestamps = store.first, store.second, store.score, store.timestamp
+        batches = store.batch
+
+        q = math.log(10) / 400
+        q2 = q**2
+        k = 3 * q2 / (math.pi**2)
+        inflation = 18.15682598**2
+
+        def inflate(track, timestamp):
+            since = 364 if math.isnan(updates[track]) else int(timestamp - updates[track])
+            return min(math.sqrt(deviations[track] ** 2 + inflation * since), 350)
+
+        def winner(i):
+            return first_ids[i] if scores[i] > 0.5 else second_ids[i] if scores[i] < 0.5 else None
+
+        def replay_batch(group, winner_id):
+            winner, timestamp = index.get(winner_id), timestamps[group[0]]
+            losers = [index.get(second_ids[i] if first_ids[i] == winner_id else first_ids[i]) for i in group]
+            opponents = [(loser, ratings[loser], inflate(loser, timestamp)) for loser in losers if loser is not None]
+
+            if winner is None or not opponents:
+                return 0
+
+            winner_rating, winner_deviation = ratings[winner], inflate(winner, timestamp)
+
+            ratings[winner], deviations[winner] = update_rating_batch(
+                winner_rating, winner_deviation, [(1.0, rating, deviation) for _, rating, deviation in opponents]
             )
+            comparisons[winner] += len(opponents)
+            updates[winner] = timestamp
+
+            for loser, rating, deviation in opponents:
+                ratings[loser], deviations[loser] = update_rating(
+                    0.0, rating, deviation, winner_rating, winner_deviation
+                )
+                comparisons[loser] += 1
+                updates[loser] = timestamp
+
+            return len(opponents)
+
+        order = store.order()
+        position = 0
+        count = 0
+
+        while position < len(order):
+            i = order[position]
+            position += 1
+
+            first, second = index.get(first_ids[i]), index.get(second_ids[i])
+            score, timestamp = scores[i], timestamps[i]
+
+            # One pick against several losers is stored as comparisons sharing a batch number, and is replayed as
+            # a single rating period just like update_playing() applied it.
+            if position < len(order) and batches[order[position]] == batches[i] and batches[i] > 0:
+                winner_id = winner(i)
+                group = [i]
+
+                while position < len(order) and batches[order[position]] == batches[i]:
+                    if winner_id is None or winner(order[position]) != winner_id:
+                        break
+
+                    group.append(order[position])
+                    position += 1
+
+                if len(group) > 1:
+                    count += replay_batch(group, winner_id)
+                    continue
 
+            if first is None or second is None:
+                continue
+
+            first_since = 364 if math.isnan(updates[first]) else int(timestamp - updates[first])
+            second_since = 364 if math.isnan(updates[second]) else int(timestamp - updates[second])
+
+            first_deviation = min(math.sqrt(deviations[first] ** 2 + inflation * first_since), 350)
+            second_deviation = min(math.sqrt(deviations[second] ** 2 + inflation * second_since), 350)
+
+            first_rating, second_rating = ratings[first], ratings[second]
+
+            # This is update_rating() applied to both sides at once, sharing the intermediate terms.
+            first_g = 1 / math.sqrt(1 + k * first_deviation * first_deviation)
+            second_g = 1 / math.sqrt(1 + k * second_deviation * second_deviation)
+
+            first_e = 1 / (1 + 10 ** (-second_g * (first_rating - second_rating) / 400))
+            second_e = 1 / (1 + 10 ** (-first_g * (second_rating - first_rating) / 400))
+
+            first_d = 1 / (first_deviation * first_deviation) + q2 * second_g * second_g * first_e * (1 - first_e)
+            second_d = 1 / (second_deviation * second_deviation) + q2 * first_g * first_g * second_e * (1 - second_e)
+
+            ratings[first] = first_rating + (q / first_d) * second_g * (score - first_e)
+            ratings[second] = second_rating + (q / second_d) * first_g * ((1 - score) - second_e)
+            deviations[first] = math.sqrt(1 / first_d)
+            deviations[second] = math.sqrt(1 / second_d)
+
+            comparisons[first] += 1
+            comparisons[second] += 1
+            updates[first] = updates[second] = timestamp
+            count += 1
+
+        epoch, epoch_julian = JULIAN_EPOCH
+
+        self._db.executemany(
+            "UPDATE tracks SET comparisons = ?, rating = ?, deviation = ?, last_update = ? WHERE id = ?;",
+            (
+                (
+                    comparisons[i],
+                    ratings[i],
+                    deviations[i],
+                    None if math.isnan(updates[i]) else epoch + datetime.timedelta(days=updates[i] - epoch_julian),
+                    track_id,
+                )
+                for i, track_id in enumerate(ids)
+            ),
+        )
+        self._db.commit()
+
+        return count
+
+    def update_metadata(self):
+        # Fill in metadata for files the scanner has not revisited since METADATA_VERSION was bumped.
+        for row in self._db.execute(
+            "SELECT id, path FROM files WHERE metadata_version < ?;", (METADATA_VERSION,)
+        ).fetchall():
+            if os.path.exists(row["path"]):
+                self._update_metadata(row["id"], row["path"], read_tags(row["path"]))
+
+        self._db.commit()
+
+    def update_playing(self, track, losing_tracks):
+        if not losing_tracks:
+            return
+
+        # The winner is rated against all losers at once; each loser only played the winner. The comparisons are
+        # numbered with the id the first of them will get, so that replay_ratings() can recognise the batch.
+        now = datetime.datetime.now()
+        batch = self._db.execute("SELECT IFNULL(MAX(id), 0) + 1 FROM comparisons;").fetchone()[0]
+
+        self._db.executemany(
+            """
+            INSERT INTO comparisons (first_track_id, second_track_id, score, timestamp, batch) VALUES (?, ?, ?, ?, ?);
+            """,
+            (
+                (track.id, losing_track.id, 1.0, now, batch)
+                if track.id < losing_track.id
+                else (losing_track.id, track.id, 0.0, now, batch)
+                for losing_track in losing_tracks
+            ),
+        )
+
+        def get_rating(track_id):
+            row = self._db.execute("SELECT * FROM tracks WHERE id = ?;", (track_id,)).fetchone()
+            since = (now - row["last_update"]).days if row["last_update"] else 364
+            return row["rating"], min(math.sqrt(row["deviation"] ** 2 + (18.15682598**2) * since), 350)
+
+        winner_rating, winner_deviation = get_rating(track.id)
+        losers = [(losing_track.id, *get_rating(losing_track.id)) for losing_track in losing_tracks]
+
+        results = [(1.0, rating, deviation) for _, rating, deviation in losers]
+        updates = [(len(losers), *update_rating_batch(winner_rating, winner_deviation, results), now, track.id)]
+
+        for loser_id, rating, deviation in losers:
+            updates.append((1, *update_rating(0.0, rating, deviation, winner_rating, winner_deviation), now, loser_id))
+
+        self._db.executemany(
+            "UPDATE tracks SET comparisons = comparisons + ?, rating = ?, deviation = ?, last_update = ? WHERE id = ?;",
+            updates,
+        )
         self._db.commit()
 
     #
@@ -498,7 +1104,7 @@ class Library(object):
     #
 
     def _add_file(self, directory_id, path):
-        tags = mutagen.File(path, easy=True)
+        tags = read_tags(path)
 
         if tags and "musicbrainz_trackid" in tags:
             mbid = tags["musicbrainz_trackid"][0]
@@ -511,10 +1117,12 @@ class Library(object):
         else:
             track_id = self._db.execute("INSERT INTO tracks (mbid) VALUES (?);", (None,)).lastrowid
 
-        self._db.execute(
+        file_id = self._db.execute(
             "INSERT INTO files (directory_id, track_id, path, last_update) VALUES (?, ?, ?, ?);",
             (directory_id, track_id, path, datetime.datetime.utcnow()),
-        )
+        ).lastrowid
+
+        self._update_metadata(file_id, path, tags)
 
     def _add_new_files(self):
         for directory in self._db.execute("SELECT * FROM directories;"):
@@ -530,14 +1138,26 @@ class Library(object):
                         elif result["last_update"] < datetime.datetime.utcfromtimestamp(
                             os.path.getmtime(os.path.join(root, path))
                         ):
-                            print_debug("_add_new_files", "Updating file")
-                            print(result["path"])
-                            print(result["last_update"])
-                            print(datetime.datetime.utcfromtimestamp(os.path.getmtime(os.path.join(root, path))))
+                            trace.event("scan.update_file", result["path"])
                             self._update_file(result)
+                        elif result["metadata_version"] < METADATA_VERSION:
+                            self._update_metadata(result["id"], result["path"], read_tags(result["path"]))
 
         self._db.commit()
 
+    def _get_random_track(self, exclude, condition="1", parameters=()):
+        # A random track matching the condition, found by seeking to a random id rather than sorting on RANDOM().
+        ids = [row["id"] for row in exclude]
+        query = "SELECT * FROM tracks WHERE {} AND id NOT IN ({}) AND id >= ? ORDER BY id LIMIT 1;".format(
+            condition, ", ".join("?" * len(ids))
+        )
+        pivot = random.randint(0, self._db.execute("SELECT IFNULL(MAX(id), 0) FROM tracks;").fetchone()[0])
+
+        return (
+            self._db.execute(query, (*parameters, *ids, pivot)).fetchone()
+            or self._db.execute(query, (*parameters, *ids, 0)).fetchone()
+        )
+
     def _initialize_db(self):
         self._db.execute("PRAGMA foreign_keys = ON;")
 
@@ -562,7 +1182,21 @@ class Library(object):
                 track_id INTEGER REFERENCES tracks(id) ON UPDATE CASCADE ON DELETE CASCADE,
                 path TEXT UNIQUE,
                 last_update TIMESTAMP,
-                priority INTEGER
+                priority INTEGER,
+                codec TEXT,
+                length REAL,
+                size INTEGER,
+                artist TEXT,
+                album TEXT,
+                title TEXT,
+                audio_hash TEXT,
+                hash_size INTEGER,
+                hash_mtime REAL,
+                track_gain REAL,
+                track_peak REAL,
+                loudness_size INTEGER,
+                loudness_mtime REAL,
+                metadata_version INTEGER DEFAULT 0
             );
         """)
 
@@ -583,13 +1217,64 @@ class Library(object):
                 first_track_id INTEGER REFERENCES tracks(id) ON UPDATE CASCADE ON DELETE CASCADE,
                 second_track_id INTEGER REFERENCES tracks(id) ON UPDATE CASCADE ON DELETE CASCADE,
                 score REAL,
-                timestamp TIMESTAMP
+                timestamp TIMESTAMP,
+                batch INTEGER
             );
         """)
 
         self._update_tables()
         self._db.commit()
 
+    def _seek_track(self, exclude, low, high):
+        # The track at the first rating at or above low, taking a random one when several tracks (such as every
+        # unrated track) share that rating.
+        result = self._db.execute(
+            "SELECT rating FROM tracks WHERE rating >= ? AND rating < ? ORDER BY rating LIMIT 1;", (low, high)
+        ).fetchone()
+
+        while result:
+            row = self._get_random_track(exclude, "rating = ?", (result["rating"],))
+
+            if row:
+                return row
+
+            result = self._db.execute(
+                "SELECT rating FROM tracks WHERE rating > ? AND rating < ? ORDER BY rating LIMIT 1;",
+                (result["rating"], high),
+            ).fetchone()
+
+        return None
+
+    def _merge_tracks(self):
+        # Applies temp.merges: files and comparisons move to the surviving track, comparisons are put back in
+        # first < second order with their score flipped, and comparisons of a track against itself are dropped.
+        self._db.execute(
+            "UPDATE files SET track_id = (SELECT new FROM temp.merges WHERE old = track_id) "
+            "WHERE track_id IN (SELECT old FROM temp.merges);"
+        )
+        self._db.execute(
+            """
+            UPDATE comparisons SET
+                first_track_id = IFNULL((SELECT new FROM temp.merges WHERE old = first_track_id), first_track_id),
+                second_track_id = IFNULL((SELECT new FROM temp.merges WHERE old = second_track_id), second_track_id)
+            WHERE first_track_id IN (SELECT old FROM temp.merges) OR second_track_id IN (SELECT old FROM temp.merges);
+            """
+        )
+        self._db.execute("DELETE FROM comparisons WHERE first_track_id = second_track_id;")
+        self._db.execute(
+            """
+            UPDATE comparisons
+            SET first_track_id = second_track_id, second_track_id = first_track_id, score = 1.0 - score
+            WHERE first_track_id > second_track_id;
+            """
+        )
+        self._db.execute("DELETE FROM tracks WHERE id IN (SELECT old FROM temp.merges);")
+        self._db.commit()
+
+        # Comparisons were rewritten in place, which the snapshot cannot detect on its own.
+        self._comparisons.invalidate()
+        self._tracks = None
+
     def _remove_missing_files(self):
         for row in self._db.execute("SELECT * FROM files;").fetchall():
             if not os.path.exists(row["path"]):
@@ -604,7 +1289,7 @@ class Library(object):
 
     def _update_file(self, row):
         track = self._db.execute("SELECT * FROM tracks WHERE id = ?;", (row["track_id"],)).fetchone()
-        tags = mutagen.File(row["path"], easy=True)
+        tags = read_tags(row["path"])
 
         if tags and "musicbrainz_trackid" in tags:
             mbid = tags["musicbrainz_trackid"][0]
@@ -612,7 +1297,7 @@ class Library(object):
             mbid = None
 
         if mbid != track["mbid"]:
-            print_debug("_update_file", "Musicbrainz ID for {} has changed".format(row["path"]))
+            trace.event("scan.mbid_changed", row["path"])
 
             # Determine if the current track has files other than this one.
             files_left = (
@@ -626,33 +1311,53 @@ class Library(object):
             new_track = self._db.execute("SELECT * FROM tracks WHERE mbid = ?;", (mbid,)).fetchone() if mbid else None
 
             if not files_left and not new_track:
-                print_debug("_update_file", "Updating MBID on existing track")
+                trace.count("scan.mbid_updated")
                 self._db.execute("UPDATE tracks SET mbid = ? WHERE id = ?", (mbid, track["id"]))
             elif not files_left and new_track:
                 if track["comparisons"] > new_track["comparisons"]:
-                    print_debug("_update_file", "Deleting new track and transferring its files to old track.")
+                    # Deleting new track and transferring its files to old track.
+                    trace.count("scan.track_merged")
                     self._db.execute(
                         "UPDATE files SET track_id = ? WHERE track_id = ?;", (track["id"], new_track["id"])
                     )
                     self._db.execute("DELETE FROM tracks WHERE id = ?;", (new_track["id"],))
                     self._db.execute("UPDATE tracks SET mbid = ? WHERE id = ?", (mbid, track["id"]))
                 else:
-                    print_debug("_update_file", "Deleting old track and its data. New track has better data.")
+                    # Deleting old track and its data. New track has better data.
+                    trace.count("scan.track_replaced")
                     self._db.execute("DELETE FROM tracks WHERE id = ?;", (track["id"],))
             elif not new_track:
-                print_debug(
-                    "_update_file",
-                    "Creating new track, but files remain on old track. New track will start with fresh data.",
-                )
+                # Creating new track, but files remain on old track. New track will start with fresh data.
+                trace.count("scan.track_split")
                 track_id = self._db.execute("INSERT INTO tracks (mbid) VALUES (?);", (mbid,)).lastrowid
                 self._db.execute("UPDATE files SET track_id = ? WHERE id = ?;", (track_id, row["id"]))
             else:
-                print_debug("_update_file", "New track exists, but files remain on old track.")
+                # New track exists, but files remain on old track.
+                trace.count("scan.file_moved")
                 self._db.execute("UPDATE files SET track_id = ? WHERE id = ?;", (new_track["id"], row["id"]))
 
         self._db.execute("UPDATE files SET last_update = ? WHERE id = ?;", (datetime.datetime.utcnow(), row["id"]))
+        self._update_metadata(row["id"], row["path"], tags)
         self._db.commit()
 
+    def _update_metadata(self, file_id, path, tags):
+        if tags is not None:
+            codec, length = get_codec(tags), tags.info.length
+            artist, album, title = (
+                tags[key][0] if key in tags and tags[key] else None for key in ["artist", "album", "title"]
+            )
+        else:
+            codec, length = None, None
+            artist, album, title = None, None, None
+
+        self._db.execute(
+            """
+            UPDATE files SET codec = ?, length = ?, size = ?, artist = ?, album = ?, title = ?, metadata_version = ?
+            WHERE id = ?;
+            """,
+            (codec, length, os.path.getsize(path), artist, album, title, METADATA_VERSION, file_id),
+        )
+
     def _update_tables(self):
         version = self._db.execute("SELECT * FROM config WHERE key = ?;", ("database_version",)).fetchone()
 
@@ -678,3 +1383,99 @@ class Library(object):
             version = 3
             self._db.execute("ALTER TABLE files ADD priority INTEGER DEFAULT 0;")
             self._db.execute("UPDATE config SET value = ? WHERE key = ?;", (version, "database_version"))
+
+        if version == 3:
+            print("Upgrading to database version 4...")
+            version = 4
+            self._db.execute("ALTER TABLE files ADD codec TEXT;")
+            self._db.execute("ALTER TABLE files ADD length REAL;")
+            self._db.execute("ALTER TABLE files ADD metadata_version INTEGER DEFAULT 0;")
+            self._db.execute("UPDATE config SET value = ? WHERE key = ?;", (version, "database_version"))
+
+        if version == 4:
+            print("Upgrading to database version 5...")
+            version = 5
+            self._db.execute("ALTER TABLE files ADD size INTEGER;")
+            self._db.execute("UPDATE config SET value = ? WHERE key = ?;", (version, "database_version"))
+
+        if version == 5:
+            print("Upgrading to database version 6...")
+            version = 6
+            self._db.execute("ALTER TABLE files ADD artist TEXT;")
+            self._db.execute("ALTER TABLE files ADD album TEXT;")
+            self._db.execute("ALTER TABLE files ADD title TEXT;")
+            self._db.execute("UPDATE config SET value = ? WHERE key = ?;", (version, "database_version"))
+
+        if version == 6:
+            print("Upgrading to database version 7...")
+            version = 7
+            self._db.execute("CREATE INDEX tracks_comparisons ON tracks (comparisons);")
+            self._db.execute("CREATE INDEX tracks_rating ON tracks (rating);")
+            self._db.execute("UPDATE config SET value = ? WHERE key = ?;", (version, "database_version"))
+
+        if version == 7:
+            print("Upgrading to database version 8...")
+            version = 8
+            self._db.execute("ALTER TABLE files ADD audio_hash TEXT;")
+            self._db.execute("ALTER TABLE files ADD hash_size INTEGER;")
+            self._db.execute("ALTER TABLE files ADD hash_mtime REAL;")
+            self._db.execute("UPDATE config SET value = ? WHERE key = ?;", (version, "database_version"))
+
+        if version == 8:
+            print("Upgrading to database version 9...")
+            version = 9
+            self._db.execute("CREATE INDEX files_track_id ON files (track_id);")
+            self._db.execute("UPDATE config SET value = ? WHERE key = ?;", (version, "database_version"))
+
+        if version == 9:
+            print("Upgrading to database version 10...")
+            version = 10
+
+            # An external-content index over the files table. The triggers keep it in step with every insert, delete
+            # and metadata change the scanner makes, including rows removed by cascading deletes.
+            self._db.execute("""
+                CREATE VIRTUAL TABLE files_search USING fts5 (
+                    artist, title, album, path,
+                    content = files, content_rowid = id, prefix = '1 2 3', tokenize = 'unicode61 remove_diacritics 2'
+                );
+            """)
+            self._db.execute("""
+                CREATE TRIGGER files_search_insert AFTER INSERT ON files BEGIN
+                    INSERT INTO files_search (rowid, artist, title, album, path)
+                    VALUES (new.id, new.artist, new.title, new.album, new.path);
+                END;
+            """)
+            self._db.execute("""
+                CREATE TRIGGER files_search_delete AFTER DELETE ON files BEGIN
+                    INSERT INTO files_search (files_search, rowid, artist, title, album, path)
+                    VALUES ('delete', old.id, old.artist, old.title, old.album, old.path);
+                END;
+            """)
+            self._db.execute("""
+                CREATE TRIGGER files_search_update AFTER UPDATE OF artist, title, album, path ON files
+                WHEN old.artist IS NOT new.artist OR old.title IS NOT new.title OR old.album IS NOT new.album
+                    OR old.path IS NOT new.path
+                BEGIN
+                    INSERT INTO files_search (files_search, rowid, artist, title, album, path)
+                    VALUES ('delete', old.id, old.artist, old.title, old.album, old.path);
+                    INSERT INTO files_search (rowid, artist, title, album, path)
+                    VALUES (new.id, new.artist, new.title, new.album, new.path);
+                END;
+            """)
+            self._db.execute("INSERT INTO files_search (files_search) VALUES ('rebuild');")
+            self._db.execute("UPDATE config SET value = ? WHERE key = ?;", (version, "database_version"))
+
+        if version == 10:
+            print("Upgrading to database version 11...")
+            version = 11
+            self._db.execute("ALTER TABLE files ADD track_gain REAL;")
+            self._db.execute("ALTER TABLE files ADD track_peak REAL;")
+            self._db.execute("ALTER TABLE files ADD loudness_size INTEGER;")
+            self._db.execute("ALTER TABLE files ADD loudness_mtime REAL;")
+            self._db.execute("UPDATE config SET value = ? WHERE key = ?;", (version, "database_version"))
+
+        if version == 11:
+            print("Upgrading to database version 12...")
+            version = 12
+            self._db.execute("ALTER TABLE comparisons ADD batch INTEGER;")
+            self._db.execute("UPDATE config SET value = ? WHERE key = ?;", (version, "database_version"))
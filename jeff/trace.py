@@ -0,0 +1,193 @@
+# -------------------------------------------------------------------------------
+#  Copyright (c) 2015 Jason Lynch <jason@calindora.com>
+#
+#  Permission is hereby granted, free of charge, to any person obtaining a copy
+#  of this software and associated documentation files (the "Software"), to deal
+#  in the Software without restriction, including without limitation the rights
+#  to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+#  copies of the Software, and to permit persons to whom the Software is
+#  furnished to do so, subject to the following conditions:
+#
+#  The above copyright notice and this permission notice shall be included in
+#  all copies or substantial portions of the Software.
+#
+#  THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+#  IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+#  FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+#  AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+#  LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+#  OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+#  SOFTWARE.
+# -------------------------------------------------------------------------------
+# type: ignore
+
+import atexit
+import collections
+import contextlib
+import json
+import math
+import os
+import re
+import sqlite3
+import sys
+import threading
+import time
+
+#
+# Constants
+#
+
+# Tracing is off unless JEFF_TRACE names a file to write the summary to ("-" for stderr). JEFF_PROFILE names a
+# file for cProfile statistics of whatever entry point is wrapped with run().
+TRACE_PATH = os.environ.get("JEFF_TRACE")
+PROFILE_PATH = os.environ.get("JEFF_PROFILE")
+
+enabled = bool(TRACE_PATH)
+
+# Span durations are bucketed by powers of two, starting at this many seconds.
+HISTOGRAM_BASE = 0.0001
+HISTOGRAM_BUCKETS = 24
+
+_start = time.perf_counter()
+_lock = threading.Lock()
+
+_spans = collections.defaultdict(list)
+_counters = collections.Counter()
+_events = []
+
+#
+# Classes
+#
+
+
+class Cursor(sqlite3.Cursor):
+    def execute(self, sql, parameters=()):
+        start = time.perf_counter()
+
+        try:
+            return super().execute(sql, parameters)
+        finally:
+            record_query(sql, time.perf_counter() - start)
+
+    def executemany(self, sql, parameters):
+        start = time.perf_counter()
+
+        try:
+            return super().executemany(sql, parameters)
+        finally:
+            record_query(sql, time.perf_counter() - start)
+
+
+class Connection(sqlite3.Connection):
+    # Query times cover preparing the statement and stepping to the first row, not iterating the result.
+    def cursor(self, factory=Cursor):
+        return super().cursor(factory)
+
+    def execute(self, sql, parameters=()):
+        return self.cursor().execute(sql, parameters)
+
+    def executemany(self, sql, parameters):
+        return self.cursor().executemany(sql, parameters)
+
+
+#
+# Functions
+#
+
+
+def connect(path, **kwargs):
+    if enabled:
+        kwargs["factory"] = Connection
+
+    return sqlite3.connect(path, **kwargs)
+
+
+def count(name, value=1):
+    if enabled:
+        with _lock:
+            _counters[name] += value
+
+
+def event(name, detail=None):
+    if enabled:
+        with _lock:
+            _events.append({"name": name, "time": time.perf_counter() - _start, "detail": detail})
+
+
+def record(name, duration):
+    if enabled:
+        with _lock:
+            _spans[name].append(duration)
+
+
+def record_query(sql, duration):
+    record("sql {}".format(re.sub(r"\s+", " ", sql).strip()[:80]), duration)
+    count("sql.queries")
+
+
+@contextlib.contextmanager
+def span(name):
+    if not enabled:
+        yield
+        return
+
+    start = time.perf_counter()
+
+    try:
+        yield
+    finally:
+        record(name, time.perf_counter() - start)
+
+
+def summary():
+    spans = {}
+
+    with _lock:
+        for name, durations in _spans.items():
+            durations = sorted(durations)
+            histogram = [0] * HISTOGRAM_BUCKETS
+
+            for duration in durations:
+                bucket = int(math.log2(duration / HISTOGRAM_BASE)) + 1 if duration >= HISTOGRAM_BASE else 0
+                histogram[min(bucket, HISTOGRAM_BUCKETS - 1)] += 1
+
+            spans[name] = {
+                "count": len(durations),
+                "total": sum(durations),
+                "mean": sum(durations) / len(durations),
+                "p50": durations[len(durations) // 2],
+                "p95": durations[int(len(durations) * 0.95)],
+                "max": durations[-1],
+                "histogram": histogram,
+            }
+
+        return {"spans": spans, "counters": dict(_counters), "events": list(_events)}
+
+
+def write():
+    data = json.dumps(summary(), indent=2, sort_keys=True)
+
+    if TRACE_PATH == "-":
+        print(data, file=sys.stderr)
+    else:
+        with open(TRACE_PATH, "w") as f:
+            f.write(data)
+
+
+def run(function, *args):
+    # Entry points call through here so that any of them can be profiled by setting JEFF_PROFILE.
+    if not PROFILE_PATH:
+        return function(*args)
+
+    import cProfile
+
+    profile = cProfile.Profile()
+
+    try:
+        return profile.runcall(function, *args)
+    finally:
+        profile.dump_stats(PROFILE_PATH)
+
+
+if enabled:
+    atexit.register(write)